@@ -14,19 +14,74 @@
 #   bin/data/images/      - Image database
 #   bin/data/features/    - Feature CSV files (created by GUI)
 #
-# Requirements: Python 3.7+, tkinter, Pillow
+# Requirements: Python 3.9+, tkinter, Pillow
 #
 # Date: February 2026
 ################################################################################
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
+from PIL import Image, ImageOps, ImageTk
+import glob
+import hashlib
 import subprocess
 import os
+import queue
+import re
 import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
+# One ranked result line from queryImage.exe: "<rank> <filename> <distance>"
+# Degenerate features print nan/inf (MSVC may write e.g. "-nan(ind)")
+_RANK_RE = re.compile(
+    r'^[ \t]*(\d+)[ \t]+(\S+)[ \t]+'
+    r'([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?|(?i:[-+]?nan(?:\(\w*\))?|[-+]?inf(?:inity)?))'
+    r'[ \t]*$',
+    re.MULTILINE
+)
+
+@lru_cache(maxsize=256)
+def _thumb_cached(path, mtime, file_size, w, h, resample):
+    """
+    Decode and downscale an image, cached per (path, mtime, file size, box, filter)
+    
+    Returns:
+        tuple: (raw bytes, size, mode) suitable for Image.frombytes
+    """
+    with Image.open(path) as img:
+        # Let the JPEG decoder downscale in the DCT domain before resampling
+        img.draft('RGB', (w * 2, h * 2))
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGBA' if img.mode in ('P', 'LA', 'PA') else 'RGB')
+        img.thumbnail((w, h), resample)
+        return img.tobytes(), img.size, img.mode
+
+def decode_thumbnail(path, size, resample=Image.Resampling.LANCZOS):
+    """
+    Return raw thumbnail data for the image at path, re-decoding only if the file changed
+    
+    Safe to call from worker threads (touches PIL only, never Tk).
+    
+    Args:
+        path: Image file path
+        size: (width, height) bounding box
+        resample: Final resampling filter
+    
+    Returns:
+        tuple: (raw bytes, size, mode) suitable for Image.frombytes
+    """
+    st = os.stat(path)
+    return _thumb_cached(path, st.st_mtime, st.st_size, *size, resample)
+
+def load_thumbnail(path, size, resample=Image.Resampling.LANCZOS):
+    """Return a thumbnail of the image at path as a PIL Image"""
+    data, thumb_size, mode = decode_thumbnail(path, size, resample)
+    return Image.frombytes(mode, thumb_size, data)
+
 class CBIRGui:
     """
     Content-Based Image Retrieval GUI Application
@@ -88,37 +143,156 @@ class CBIRGui:
             'dnn': {
                 'csv': os.path.join(self.features_dir, 'ResNet18_olym.csv'),
                 'metric': 'cosine',
-                'description': 'ResNet18 DNN Embeddings (Pre-computed)'
+                'description': 'ResNet18 DNN Embeddings (Pre-computed)',
+                'needs_filename': True  # exe looks up features by query filename
             },
             'productmatcher': {
                 'csv': os.path.join(self.features_dir, 'product_features.csv'),
                 'metric': 'productmatcher',
-                'description': 'Task 7: DNN(60%) + Center-Color(40%)'
+                'description': 'Task 7: DNN(60%) + Center-Color(40%)',
+                'needs_filename': True  # exe looks up features by query filename
             },
             'faceaware': {
                 'csv': os.path.join(self.features_dir, 'faceaware_features.csv'),
                 'metric': 'faceaware',
-                'description': 'Extension: Adaptive Face-Aware Features'
+                'description': 'Extension: Adaptive Face-Aware Features',
+                'needs_filename': True  # exe looks up features by query filename
             }
         }
         
+        # Precompute exe paths and exe-relative arguments (fixed at runtime)
+        self._build_exe = os.path.join(self.exe_dir, 'buildFeatureDB.exe')
+        self._query_exe = os.path.join(self.exe_dir, 'queryImage.exe')
+        self._image_dir_rel = os.path.relpath(self.image_dir, self.exe_dir)
+        for config in self.features_config.values():
+            config['csv_rel'] = os.path.relpath(config['csv'], self.exe_dir)
+        
         # State
         self.selected_image_path = None
+        self._query_image_rel = None
+        self._selection_gen = 0  # Bumped on selection so stale query results are dropped
+        self._building = False  # Builds and queries exclude each other (shared CSVs)
+        self._querying = False
         self.query_results = []
-        self.result_images = []
+        self.result_images = deque()  # Keeps PhotoImages alive while their labels exist
+        self._display_gen = 0  # Bumped on clear so stale thumbnail callbacks are dropped
+        self._csv_state = self._scan_csv_names()  # Feature CSV filenames, from one scandir
+        
+        # Worker pool for exe invocations so the Tk main loop never blocks
+        self._pool = ThreadPoolExecutor(max_workers=4)
+        # Single worker so query cache writes land in selection order
+        self._query_cache_pool = ThreadPoolExecutor(max_workers=1)
+        self._query_cache_future = None
+        self._query_cache_file = None  # Current PPM, written by the cache worker
+        self._sweep_query_cache()  # Leftovers from a previous session
+        self._build_all_executor = None
+        
+        # Running exe processes, killed if the window is closed mid-run
+        self._procs = set()
+        self._procs_lock = threading.Lock()
+        self._closing = False
+        # Worker -> Tk handoff; workers only enqueue, the Tk thread drains
+        self._events = queue.SimpleQueue()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Verify executables exist
         self.verify_setup()
         
         # Build UI
         self.create_ui()
+        
+        # Keep the CSV listing current if files change outside the GUI
+        self.root.after(2000, self._poll_csv_state)
+        
+        # Run worker callbacks on the Tk thread
+        self.root.after(50, self._drain_events)
+    
+    def _post(self, callback, *args):
+        """
+        Queue callback to run on the Tk thread; safe to call from any worker
+        
+        Workers never call into Tk themselves: with threaded Tcl a cross-thread
+        root.after blocks until serviced, which hangs forever once mainloop ends.
+        """
+        if not self._closing:
+            self._events.put((callback, args))
+    
+    def _drain_events(self):
+        """Run queued worker callbacks, then poll again (runs on Tk thread)"""
+        try:
+            while True:
+                try:
+                    callback, args = self._events.get_nowait()
+                except queue.Empty:
+                    break
+                callback(*args)
+        finally:
+            if not self._closing:
+                self.root.after(50, self._drain_events)
+    
+    def on_close(self):
+        """Stop pending work and running exes, then close the window"""
+        self._closing = True
+        
+        executors = (self._pool, self._query_cache_pool, self._build_all_executor)
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        
+        with self._procs_lock:
+            for proc in self._procs:
+                if proc.poll() is None:
+                    proc.kill()
+        
+        # A write still in flight removes its own file once it sees _closing
+        self._sweep_query_cache()
+        
+        self.root.destroy()
+    
+    def _scan_csv_names(self):
+        """
+        List the files in the features directory with a single scandir
+        
+        Returns:
+            set: Filenames present (empty if the directory can't be read)
+        """
+        try:
+            with os.scandir(self.features_dir) as entries:
+                return {entry.name for entry in entries if entry.is_file()}
+        except OSError as e:
+            print(f"Error scanning {self.features_dir}: {e}")
+            return set()
+    
+    def _refresh_csv_state(self, reschedule=False):
+        """Rescan the features directory on the worker pool, off the Tk thread"""
+        future = self._pool.submit(self._scan_csv_names)
+        future.add_done_callback(
+            lambda f: self._post(self._on_csv_scan_done, f, reschedule)
+        )
+    
+    def _on_csv_scan_done(self, future, reschedule):
+        """Store a finished CSV scan (runs on Tk thread)"""
+        self._csv_state = future.result()
+        if reschedule:
+            self.root.after(2000, self._poll_csv_state)
+    
+    def _poll_csv_state(self):
+        """Periodically refresh the CSV listing; the next poll is queued once this scan lands"""
+        self._refresh_csv_state(reschedule=True)
     
     def verify_setup(self):
         """Verify that executables and directories exist"""
-        build_exe = os.path.join(self.exe_dir, 'buildFeatureDB.exe')
-        query_exe = os.path.join(self.exe_dir, 'queryImage.exe')
+        build_exe = self._build_exe
+        query_exe = self._query_exe
         
-        if not os.path.exists(build_exe):
+        # List the exe directory once and check both executables in memory
+        try:
+            with os.scandir(self.exe_dir) as entries:
+                exe_entries = {entry.name for entry in entries}
+        except OSError:
+            exe_entries = set()
+        
+        if os.path.basename(build_exe) not in exe_entries:
             messagebox.showerror(
                 "Setup Error",
                 f"buildFeatureDB.exe not found at:\n{build_exe}\n\n"
@@ -126,7 +300,7 @@ class CBIRGui:
             )
             sys.exit(1)
         
-        if not os.path.exists(query_exe):
+        if os.path.basename(query_exe) not in exe_entries:
             messagebox.showerror(
                 "Setup Error",
                 f"queryImage.exe not found at:\n{query_exe}\n\n"
@@ -134,7 +308,7 @@ class CBIRGui:
             )
             sys.exit(1)
         
-        if not os.path.exists(self.image_dir):
+        if not os.path.isdir(self.image_dir):
             messagebox.showwarning(
                 "Setup Warning",
                 f"Image directory not found:\n{self.image_dir}\n\n"
@@ -212,11 +386,13 @@ class CBIRGui:
         build_frame = ttk.LabelFrame(main_frame, text="3. Database Building", padding="10")
         build_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
         
-        ttk.Button(build_frame, text="Build All Features", 
-                  command=self.build_all_databases).grid(row=0, column=0, padx=5)
+        self.build_all_button = ttk.Button(build_frame, text="Build All Features", 
+                                          command=self.build_all_databases)
+        self.build_all_button.grid(row=0, column=0, padx=5)
         
-        ttk.Button(build_frame, text="Build Database (Selected Feature)", 
-                  command=self.build_selected_database).grid(row=0, column=1, padx=5)
+        self.build_selected_button = ttk.Button(build_frame, text="Build Database (Selected Feature)", 
+                                               command=self.build_selected_database)
+        self.build_selected_button.grid(row=0, column=1, padx=5)
         
         self.build_status_label = ttk.Label(build_frame, text="Ready to build databases", 
                                            foreground="gray")
@@ -228,8 +404,9 @@ class CBIRGui:
         query_frame = ttk.LabelFrame(main_frame, text="4. Query Execution", padding="10")
         query_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
         
-        ttk.Button(query_frame, text="🔍 Find Matching Images", 
-                  command=self.find_matches).grid(row=0, column=0, padx=5, pady=10)
+        self.query_button = ttk.Button(query_frame, text="🔍 Find Matching Images", 
+                                      command=self.find_matches)
+        self.query_button.grid(row=0, column=0, padx=5, pady=10)
         
         self.query_status_label = ttk.Label(query_frame, text="Select image and click to query",
                                            foreground="gray")
@@ -283,6 +460,11 @@ class CBIRGui:
         
         if filepath:
             self.selected_image_path = filepath
+            self._selection_gen += 1
+            self._query_image_rel = os.path.relpath(filepath, self.exe_dir)
+            self._query_cache_future = self._query_cache_pool.submit(
+                self._write_query_cache, filepath
+            )
             filename = os.path.basename(filepath)
             self.image_label.config(text=f"Selected: {filename}")
             
@@ -292,6 +474,79 @@ class CBIRGui:
             # Show preview of selected image
             self.show_query_preview()
     
+    def _sweep_query_cache(self, keep=None):
+        """
+        Delete query cache PPMs (and stray .tmp files) from the features directory
+        
+        Files a running exe still holds open (Windows) can't be removed; they are
+        retried on the next sweep.
+        
+        Args:
+            keep: Optional cache file to leave in place
+        """
+        pattern = os.path.join(self.features_dir, '_query_cache_*.ppm*')
+        for path in glob.glob(pattern):
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def _write_query_cache(self, filepath):
+        """
+        Decode the query image once and save it as PPM for queryImage.exe
+        
+        Each image gets its own file (named from its path and mtime), so a query
+        that is still starting up never sees pixels from a newer selection. Files
+        from earlier selections are swept.
+        
+        Args:
+            filepath: Path to the selected query image
+            
+        Returns:
+            tuple: (filepath, cache path relative to exe dir), or None if the
+                   original image should be passed instead
+        """
+        tmp_path = None
+        try:
+            key = f"{os.path.abspath(filepath)}|{os.stat(filepath).st_mtime}"
+            digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+            cache_file = os.path.join(self.features_dir, f'_query_cache_{digest}.ppm')
+            
+            if cache_file != self._query_cache_file:
+                # Also retries files a running exe held open on earlier sweeps
+                self._query_cache_file = None
+                self._sweep_query_cache()
+                
+                with Image.open(filepath) as img:
+                    # 16-bit and other modes are scaled differently by cv::imread
+                    if img.mode not in ('L', 'RGB', 'RGBA', 'P'):
+                        print(f"Query image mode {img.mode} not cached; using original file")
+                        return None
+                    # cv::imread applies EXIF orientation, so do the same here
+                    img = ImageOps.exif_transpose(img).convert('RGB')
+                    tmp_path = cache_file + '.tmp'
+                    img.save(tmp_path, format='PPM')
+                os.replace(tmp_path, cache_file)
+                tmp_path = None
+                self._query_cache_file = cache_file
+                
+                if self._closing:
+                    # Window closed mid-write; on_close's sweep may have run already
+                    self._sweep_query_cache()
+                    return None
+            
+            return filepath, os.path.relpath(cache_file, self.exe_dir)
+        except Exception as e:
+            print(f"Error caching query image {filepath}: {e}")
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return None
+    
     def show_query_preview(self):
         """Display preview of query image in results area"""
         self.clear_results()
@@ -304,8 +559,7 @@ class CBIRGui:
             header.grid(row=0, column=0, pady=10)
             
             # Load and display query image
-            img = Image.open(self.selected_image_path)
-            img.thumbnail((400, 400), Image.Resampling.LANCZOS)
+            img = load_thumbnail(self.selected_image_path, (400, 400))
             photo = ImageTk.PhotoImage(img)
             
             img_label = ttk.Label(self.results_inner_frame, image=photo)
@@ -321,25 +575,62 @@ class CBIRGui:
         except Exception as e:
             print(f"Error showing preview: {e}")
     
+    def _update_action_buttons(self):
+        """
+        Enable build and query buttons only when no build or query is running
+        
+        A query must not load a CSV that a build is rewriting, and vice versa.
+        """
+        busy = self._building or self._querying
+        for button in (self.build_all_button, self.build_selected_button, self.query_button):
+            button.state(['disabled' if busy else '!disabled'])
+    
     def build_all_databases(self):
         """Build feature databases for all feature types"""
         self.build_status_label.config(text="Building all databases... Please wait...", 
                                       foreground="orange")
-        self.root.update()
+        self._building = True
+        self._update_action_buttons()
         
-        success_count = 0
-        failed = []
+        self._build_all_total = len(self.features_config)
+        self._build_all_done = 0
+        self._build_all_failed = []
         
+        # Feature extractors are independent processes, so run them concurrently
+        max_workers = min(os.cpu_count() or 1, self._build_all_total)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._build_all_executor = executor
         for feature_name, config in self.features_config.items():
             print(f"\nBuilding {feature_name} database...")
-            success = self.build_database(feature_name, config['csv'])
-            if success:
-                success_count += 1
-            else:
-                failed.append(feature_name)
+            future = executor.submit(self.build_database, feature_name, config['csv_rel'])
+            future.add_done_callback(
+                lambda f, name=feature_name: self._post(self._on_build_all_progress, f, name)
+            )
+        executor.shutdown(wait=False)
+    
+    def _on_build_all_progress(self, future, feature_name):
+        """Tally one finished build from build_all_databases (runs on Tk thread)"""
+        self._build_all_done += 1
+        if future.result():
+            self._refresh_csv_state()
+        else:
+            self._build_all_failed.append(feature_name)
+        
+        total = self._build_all_total
+        if self._build_all_done < total:
+            self.build_status_label.config(
+                text=f"Building all databases... {self._build_all_done}/{total} finished ({feature_name})",
+                foreground="orange"
+            )
+            return
+        
+        self._building = False
+        self._update_action_buttons()
+        failed = self._build_all_failed
+        success_count = total - len(failed)
         
         if failed:
-            msg = f"Built {success_count}/{len(self.features_config)} databases.\nFailed: {', '.join(failed)}"
+            msg = f"Built {success_count}/{total} databases.\nFailed: {', '.join(failed)}"
             self.build_status_label.config(text=msg, foreground="orange")
             messagebox.showwarning("Partial Success", msg)
         else:
@@ -359,13 +650,31 @@ class CBIRGui:
             text=f"Building {feature} database... Please wait...", 
             foreground="orange"
         )
-        self.root.update()
+        self._building = True
+        self._update_action_buttons()
         
-        success = self.build_database(feature, config['csv'])
+        on_line = lambda line: self._post(self._on_build_line, feature, line)
+        future = self._pool.submit(self.build_database, feature, config['csv_rel'], on_line)
+        future.add_done_callback(
+            lambda f: self._post(self._on_build_selected_done, f, feature, config['csv'])
+        )
+    
+    def _on_build_line(self, feature, line):
+        """Show the latest buildFeatureDB.exe output line as live progress"""
+        line = line.strip()
+        if line and not line.startswith(('=', '-')):
+            self.build_status_label.config(text=f"Building {feature}: {line}",
+                                          foreground="orange")
+    
+    def _on_build_selected_done(self, future, feature, csv_path):
+        """Report result of build_selected_database (runs on Tk thread)"""
+        self._building = False
+        self._update_action_buttons()
         
-        if success:
+        if future.result():
+            self._refresh_csv_state()
             self.build_status_label.config(
-                text=f"Database '{os.path.basename(config['csv'])}' built successfully!", 
+                text=f"Database '{os.path.basename(csv_path)}' built successfully!", 
                 foreground="green"
             )
             messagebox.showinfo("Success", f"{feature} database built successfully!")
@@ -376,45 +685,91 @@ class CBIRGui:
             )
             messagebox.showerror("Error", f"Failed to build {feature} database.\nCheck console for details.")
     
-    def build_database(self, feature_type, csv_path):
+    def run_streaming(self, cmd, timeout, on_line=None):
+        """
+        Run an exe from the exe directory, streaming its output line by line
+        
+        stderr is merged into stdout so a chatty stderr cannot stall the pipe
+        while stdout is being read.
+        
+        Args:
+            cmd: Command list to execute
+            timeout: Seconds before the process is killed
+            on_line: Optional callable invoked with each output line as it arrives
+            
+        Returns:
+            subprocess.CompletedProcess: returncode and full combined output
+            
+        Raises:
+            subprocess.TimeoutExpired: If the process ran longer than timeout
+        """
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            cwd=self.exe_dir
+        )
+        with self._procs_lock:
+            if self._closing:
+                proc.kill()  # Window closed while this process was starting
+            self._procs.add(proc)
+        
+        # Reading stdout blocks, so enforce the timeout by killing the process
+        timed_out = threading.Event()
+        def kill():
+            timed_out.set()
+            proc.kill()
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        
+        lines = []
+        try:
+            for line in proc.stdout:
+                lines.append(line)
+                if on_line:
+                    on_line(line)
+            proc.wait()
+        finally:
+            timer.cancel()
+            # Don't orphan the exe if on_line raised mid-stream
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            with self._procs_lock:
+                self._procs.discard(proc)
+        
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout, output=''.join(lines))
+        
+        return subprocess.CompletedProcess(cmd, proc.returncode, ''.join(lines))
+    
+    def build_database(self, feature_type, csv_rel, on_line=None):
         """
         Execute buildFeatureDB.exe to create feature database
         
         Args:
             feature_type: Feature type identifier
-            csv_path: Full path to output CSV file
+            csv_rel: Output CSV path relative to the exe directory
+            on_line: Optional callable receiving exe output lines as they arrive
             
         Returns:
             bool: True if successful
         """
         try:
-            # Get just the CSV filename (exe expects path relative to its location)
-            csv_filename = os.path.relpath(csv_path, self.exe_dir)
-            
-            # Command to execute
-            cmd = [
-                os.path.join(self.exe_dir, 'buildFeatureDB.exe'),
-                os.path.relpath(self.image_dir, self.exe_dir),  # Relative to exe
-                feature_type,
-                csv_filename
-            ]
+            # Command to execute (paths relative to exe location)
+            cmd = [self._build_exe, self._image_dir_rel, feature_type, csv_rel]
             
             print(f"Executing: {' '.join(cmd)}")
             
             # Run from exe directory
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300,  # 5 minute timeout
-                cwd=self.exe_dir
-            )
+            result = self.run_streaming(cmd, timeout=300, on_line=on_line)  # 5 minute timeout
             
             # Print output for debugging
             if result.stdout:
                 print(result.stdout)
-            if result.stderr:
-                print("STDERR:", result.stderr)
             
             if result.returncode == 0:
                 print(f"✓ Built {feature_type} database successfully")
@@ -444,8 +799,11 @@ class CBIRGui:
         metric = config['metric']
         top_n = int(self.topn_var.get())
         
-        # Check if CSV exists
-        if not os.path.exists(csv_file):
+        # Check if CSV exists (rescan once in case the listing is stale)
+        csv_name = os.path.basename(csv_file)
+        if csv_name not in self._csv_state:
+            self._csv_state = self._scan_csv_names()
+        if csv_name not in self._csv_state:
             msg = f"Database '{os.path.basename(csv_file)}' not found!\n\nPlease build the database first."
             messagebox.showerror("Database Not Found", msg)
             return
@@ -455,45 +813,73 @@ class CBIRGui:
             text=f"Querying with {feature}... Please wait...",
             foreground="orange"
         )
-        self.root.update()
         
-        # Execute query
-        try:
-            # Get paths relative to exe directory
-            query_image_rel = os.path.relpath(self.selected_image_path, self.exe_dir)
-            csv_file_rel = os.path.relpath(csv_file, self.exe_dir)
-            
-            cmd = [
-                os.path.join(self.exe_dir, 'queryImage.exe'),
-                query_image_rel,
-                csv_file_rel,
-                feature,
-                metric,
-                str(top_n)
-            ]
-            
-            print(f"Executing: {' '.join(cmd)}")
-            
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=60,
-                cwd=self.exe_dir
+        # Use the pre-decoded PPM when it is ready for this image, unless the
+        # feature needs the original filename to look up its features
+        image_arg = self._query_image_rel
+        cache = self._query_cache_future
+        if not config.get('needs_filename') and cache is not None and cache.done():
+            cached = cache.result()
+            if cached is not None and cached[0] == self.selected_image_path:
+                image_arg = cached[1]
+        
+        cmd = [
+            self._query_exe,
+            image_arg,
+            config['csv_rel'],
+            feature,
+            metric,
+            str(top_n)
+        ]
+        
+        print(f"Executing: {' '.join(cmd)}")
+        
+        # Execute query on the worker pool; results are handled on the Tk thread
+        self._querying = True
+        self._update_action_buttons()
+        self._query_parsed = 0
+        query_path = self.selected_image_path
+        gen = self._selection_gen
+        on_line = lambda line: self._post(self._on_query_line, gen, line, top_n)
+        future = self._pool.submit(self.run_streaming, cmd, 60, on_line)
+        future.add_done_callback(
+            lambda f: self._post(self._on_query_done, f, gen, query_path, feature, metric)
+        )
+    
+    def _on_query_line(self, gen, line, top_n):
+        """Count ranked results as queryImage.exe emits them"""
+        if gen == self._selection_gen and _RANK_RE.match(line):
+            self._query_parsed += 1
+            self.query_status_label.config(
+                text=f"Parsed {self._query_parsed}/{top_n} results...",
+                foreground="orange"
             )
+    
+    def _on_query_done(self, future, gen, query_path, feature, metric):
+        """Handle finished queryImage.exe run (runs on Tk thread)"""
+        self._querying = False
+        self._update_action_buttons()
+        
+        if gen != self._selection_gen:
+            # A different image was selected while this query ran
+            self.query_status_label.config(text="Select image and click to query",
+                                           foreground="gray")
+            return
+        
+        try:
+            result = future.result()
             
             if result.stdout:
                 print(result.stdout)
             
             if result.returncode == 0:
                 # Parse results
-                self.parse_and_display_results(result.stdout, feature, metric)
+                self.parse_and_display_results(result.stdout, query_path, feature, metric)
             else:
                 self.query_status_label.config(
                     text="Query failed!", 
                     foreground="red"
                 )
-                print("STDERR:", result.stderr)
                 messagebox.showerror("Query Error", 
                                     f"Query failed!\n\nCheck console for details.")
                 
@@ -504,9 +890,9 @@ class CBIRGui:
             self.query_status_label.config(text="Query error!", foreground="red")
             messagebox.showerror("Error", f"Query error: {e}")
     
-    def parse_and_display_results(self, output, feature, metric):
+    def parse_and_display_results(self, output, query_path, feature, metric):
         """
-        Parse query output and display results
+        Parse query output and display results for the image at query_path
         
         Expected output format:
         ========================================
@@ -519,46 +905,35 @@ class CBIRGui:
         2     pic.0123.jpg                  0.1234
         ...
         """
-        lines = output.split('\n')
-        
-        # Find results section
+        # Find results section: skip the header and dash lines, stop at the '=' rule
         results = []
-        in_results = False
+        header_pos = output.find('\nRank')
         
-        for line in lines:
-            if 'Rank' in line and 'Filename' in line and 'Distance' in line:
-                in_results = True
-                continue
+        if header_pos >= 0:
+            parts = output[header_pos + 1:].split('\n', 2)
+            body = parts[2] if len(parts) == 3 else ''
+            end = ('\n' + body).find('\n=')
+            if end >= 0:
+                body = body[:end]
             
-            if in_results and line.strip():
-                if line.startswith('='):
-                    break
-                    
-                parts = line.split()
-                if len(parts) >= 3:
-                    try:
-                        rank = int(parts[0])
-                        filename = parts[1]
-                        distance = float(parts[2])
-                        results.append({
-                            'rank': rank,
-                            'filename': filename,
-                            'distance': distance
-                        })
-                    except:
-                        pass
+            for m in _RANK_RE.finditer(body):
+                results.append({
+                    'rank': int(m[1]),
+                    'filename': m[2],
+                    'distance': float(m[3].split('(')[0])
+                })
         
         if results:
             self.query_status_label.config(
                 text=f"Found {len(results)} matches using {feature}",
                 foreground="green"
             )
-            self.display_results(results, feature, metric)
+            self.display_results(results, query_path, feature, metric)
         else:
             self.query_status_label.config(text="No results found", foreground="red")
             messagebox.showwarning("No Results", "No matching images found!")
     
-    def display_results(self, results, feature, metric):
+    def display_results(self, results, query_path, feature, metric):
         """Display results in grid layout"""
         # Clear previous results
         self.clear_results()
@@ -568,7 +943,7 @@ class CBIRGui:
         header_frame.grid(row=0, column=0, columnspan=3, pady=10)
         
         ttk.Label(header_frame, 
-                 text=f"Query: {os.path.basename(self.selected_image_path)}", 
+                 text=f"Query: {os.path.basename(query_path)}", 
                  font=('Arial', 11, 'bold')).grid(row=0, column=0, padx=15)
         
         ttk.Label(header_frame, 
@@ -583,67 +958,84 @@ class CBIRGui:
                  text=f"Results: {len(results)}", 
                  font=('Arial', 10)).grid(row=0, column=3, padx=15)
         
-        # Display results in grid (3 columns)
-        cols = 3
+        # Hold at most one grid's worth of PhotoImages
+        self.result_images = deque(maxlen=len(results))
+        
+        # Decode thumbnails on the worker pool; widgets are placed on the Tk thread
+        gen = self._display_gen
         img_size = (220, 220)
         
         for idx, result in enumerate(results):
-            row = (idx // cols) + 1
-            col = idx % cols
+            img_path = os.path.join(self.image_dir, result['filename'])
+            # BILINEAR is visually indistinguishable from LANCZOS at grid size
+            future = self._pool.submit(decode_thumbnail, img_path, img_size,
+                                       Image.Resampling.BILINEAR)
+            future.add_done_callback(
+                lambda f, idx=idx, result=result, img_path=img_path:
+                    self._post(self._place_result, gen, idx, result, img_path, f)
+            )
+    
+    def _place_result(self, gen, idx, result, img_path, future):
+        """Place one decoded result thumbnail in the grid (runs on Tk thread)"""
+        if gen != self._display_gen:
+            return  # Results were cleared while this thumbnail was decoding
+        
+        # Display results in grid (3 columns)
+        cols = 3
+        row = (idx // cols) + 1
+        col = idx % cols
+        
+        # Create frame for each result
+        result_frame = ttk.Frame(self.results_inner_frame, relief=tk.RIDGE, borderwidth=2)
+        result_frame.grid(row=row, column=col, padx=10, pady=10)
+        
+        try:
+            # Build image from decoded thumbnail data
+            data, size, mode = future.result()
+            img = Image.frombytes(mode, size, data)
+            photo = ImageTk.PhotoImage(img)
             
-            # Create frame for each result
-            result_frame = ttk.Frame(self.results_inner_frame, relief=tk.RIDGE, borderwidth=2)
-            result_frame.grid(row=row, column=col, padx=10, pady=10)
+            # Image label
+            img_label = ttk.Label(result_frame, image=photo)
+            img_label.image = photo  # Keep reference
+            img_label.grid(row=0, column=0, padx=5, pady=5)
             
-            # Construct image path
-            img_path = os.path.join(self.image_dir, result['filename'])
+            # Rank badge
+            rank_color = "green" if result['rank'] == 1 else "blue"
+            rank_label = ttk.Label(result_frame, 
+                                  text=f"Rank {result['rank']}", 
+                                  font=('Arial', 10, 'bold'),
+                                  foreground=rank_color)
+            rank_label.grid(row=1, column=0, pady=2)
             
-            try:
-                # Load image
-                img = Image.open(img_path)
-                img.thumbnail(img_size, Image.Resampling.LANCZOS)
-                photo = ImageTk.PhotoImage(img)
-                
-                # Image label
-                img_label = ttk.Label(result_frame, image=photo)
-                img_label.image = photo  # Keep reference
-                img_label.grid(row=0, column=0, padx=5, pady=5)
-                
-                # Rank badge
-                rank_color = "green" if result['rank'] == 1 else "blue"
-                rank_label = ttk.Label(result_frame, 
-                                      text=f"Rank {result['rank']}", 
-                                      font=('Arial', 10, 'bold'),
-                                      foreground=rank_color)
-                rank_label.grid(row=1, column=0, pady=2)
-                
-                # Filename
-                ttk.Label(result_frame, 
-                         text=result['filename'], 
-                         font=('Arial', 9)).grid(row=2, column=0)
-                
-                # Distance
-                distance_text = f"Distance: {result['distance']:.4f}"
-                if result['rank'] == 1:
-                    distance_text += " (Query)"
-                ttk.Label(result_frame, 
-                         text=distance_text,
-                         font=('Arial', 8),
-                         foreground="gray").grid(row=3, column=0, pady=2)
-                
-                self.result_images.append(photo)  # Keep reference
-                
-            except Exception as e:
-                ttk.Label(result_frame, 
-                         text=f"Error loading\n{result['filename']}",
-                         foreground="red").grid(row=0, column=0, padx=5, pady=5)
-                print(f"Error loading image {img_path}: {e}")
+            # Filename
+            ttk.Label(result_frame, 
+                     text=result['filename'], 
+                     font=('Arial', 9)).grid(row=2, column=0)
+            
+            # Distance
+            distance_text = f"Distance: {result['distance']:.4f}"
+            if result['rank'] == 1:
+                distance_text += " (Query)"
+            ttk.Label(result_frame, 
+                     text=distance_text,
+                     font=('Arial', 8),
+                     foreground="gray").grid(row=3, column=0, pady=2)
+            
+            self.result_images.append(photo)  # Keep reference
+            
+        except Exception as e:
+            ttk.Label(result_frame, 
+                     text=f"Error loading\n{result['filename']}",
+                     foreground="red").grid(row=0, column=0, padx=5, pady=5)
+            print(f"Error loading image {img_path}: {e}")
     
     def clear_results(self):
         """Clear previous results"""
         for widget in self.results_inner_frame.winfo_children():
             widget.destroy()
         self.result_images.clear()
+        self._display_gen += 1
 
 def main():
     """Main entry point"""